@@ -117,7 +117,7 @@ class Order(database.Model):
     address_street: Mapped[str] = mapped_column(String(250), nullable=False)
     address_home: Mapped[str] = mapped_column(String(250), nullable=False)
     address_zip_code: Mapped[str] = mapped_column(String(250), nullable=False)
-    status: Mapped[int] = mapped_column(Integer, nullable=False)
+    status: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
     delivery: Mapped[str] = mapped_column(String(250), nullable=False)
     payment_method: Mapped[str] = mapped_column(String(250), nullable=False)
 
@@ -141,6 +141,18 @@ class OrderItems(database.Model):
     id_item: Mapped[int] = mapped_column(Integer, database.ForeignKey('items.id'))
 
 
+# historia zmian statusu zamowien - tylko dopisujemy, nigdy nie edytujemy ani nie usuwamy wpisow
+class OrderStatusHistory(database.Model):
+    __tablename__ = 'orders_status_history'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    id_order: Mapped[int] = mapped_column(Integer, database.ForeignKey('orders.id'), nullable=False, index=True)
+    status_from: Mapped[int] = mapped_column(Integer, nullable=False)
+    status_to: Mapped[int] = mapped_column(Integer, nullable=False)
+    user_id: Mapped[int] = mapped_column(Integer, database.ForeignKey('users.id'), nullable=True)
+    date_change: Mapped[str] = mapped_column(String(250), nullable=False)
+    time_change: Mapped[str] = mapped_column(String(250), nullable=False)
+
+
 class Newsletter(database.Model):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     email: Mapped[str] = mapped_column(String(250), nullable=False, unique=True)
@@ -149,6 +161,9 @@ class Newsletter(database.Model):
 
 with app.app_context():
     database.create_all()
+    # create_all nie dodaje indeksow do juz istniejacych tabel wiec tworze je osobno
+    for index in Order.__table__.indexes:
+        index.create(database.engine, checkfirst=True)
 
 
 # FUNCTIONS
@@ -184,6 +199,41 @@ def send_mail(to_email: str, msg_body, msg_title):
                             msg=f'Subject:{msg_title}\n\n{msg_body}')
 
 
+def record_status_changes(changes: list):
+    # changes -> [(id_order, status_from, status_to), ...], jeden insert dla wszystkich wpisow
+    if not changes:
+        return
+    now = datetime.datetime.now()
+    user_id = current_user.id if current_user.is_authenticated else None
+    database.session.execute(database.insert(OrderStatusHistory), [
+        {'id_order': id_order, 'status_from': status_from, 'status_to': status_to, 'user_id': user_id,
+         'date_change': now.strftime('%Y-%m-%d'), 'time_change': now.strftime('%H:%M:%S')}
+        for id_order, status_from, status_to in changes])
+
+
+def advance_orders_status(order_ids: list, expected_status: int) -> list:
+    # jeden UPDATE dla wszystkich zamowien, warunek status == expected_status pilnuje zeby dwoch pracownikow
+    # nie przesunelo tego samego zamowienia dwa razy - drugi UPDATE po prostu nie znajdzie juz tego wiersza
+    if not order_ids:
+        return []
+    statement = (database.update(Order)
+                 .where(Order.id.in_(order_ids), Order.status == expected_status)
+                 .values(status=Order.status + 1)
+                 .execution_options(synchronize_session=False))
+    if database.engine.dialect.update_returning:
+        advanced_ids = database.session.execute(statement.returning(Order.id)).scalars().all()
+    else:
+        # baza bez UPDATE ... RETURNING (np. MySQL) - blokuje wiersze i aktualizuje tylko te zablokowane
+        advanced_ids = database.session.execute(
+            database.select(Order.id).where(Order.id.in_(order_ids), Order.status == expected_status)
+            .with_for_update()).scalars().all()
+        if advanced_ids:
+            database.session.execute(statement.where(Order.id.in_(advanced_ids)))
+    record_status_changes([(order_id, expected_status, expected_status + 1) for order_id in advanced_ids])
+    database.session.commit()
+    return advanced_ids
+
+
 def set_up_session():
     if 'cart' not in session:
         session['cart'] = []
@@ -445,13 +495,50 @@ def dashboard_all_orders():
 @app.route('/dashboard/update_status')
 @permitted_only
 def order_update_status():
-    requested_order = database.session.execute(
-        database.select(Order).where(Order.id == request.args.get('order_id'))).scalar()
-    requested_order.status += 1
-    database.session.commit()
+    order_id = request.args.get('order_id', type=int)
+    # status ktory widzial pracownik na liscie, a nie aktualny z bazy - inaczej dwa klikniecia przesuna zamowienie dwa razy
+    status = request.args.get('status', type=int)
+    if order_id is None or status is None:
+        flash('Missing or invalid order id/status')
+        return redirect(url_for('dashboard_all_orders'))
+    if not advance_orders_status([order_id], status):
+        flash(f'Order id: {order_id} status has been changed by someone else, try again')
     return redirect(url_for('dashboard_all_orders'))
 
 
+@app.route('/dashboard/orders/queue')
+@permitted_only
+def dashboard_orders_queue():
+    status = request.args.get('status', 1, type=int)
+    # tylko zamowienia w danym statusie - idzie po indeksie na orders.status zamiast ladowac cala tabele
+    queue_orders = database.session.execute(
+        database.select(Order).where(Order.status == status).order_by(Order.id)).scalars().all()
+    status_counts = database.session.execute(
+        database.select(Order.status, database.func.count(Order.id)).group_by(Order.status).order_by(
+            Order.status)).all()
+    return render_template('dashboard_orders_queue.html', queue_orders=queue_orders, status=status,
+                           status_counts=status_counts)
+
+
+@app.route('/dashboard/orders/queue/advance', methods=['POST'])
+@permitted_only
+def dashboard_orders_queue_advance():
+    status = request.form.get('status', type=int)
+    if status is None:
+        flash('Missing or invalid status')
+        return redirect(url_for('dashboard_orders_queue'))
+    selected_ids = set(request.form.getlist('order_ids', type=int))
+    if not selected_ids:
+        flash('No orders selected')
+        return redirect(url_for('dashboard_orders_queue', status=status))
+    advanced_ids = advance_orders_status(list(selected_ids), status)
+    flash(f'{len(advanced_ids)} orders moved from status {status} to {status + 1}')
+    skipped = len(selected_ids) - len(advanced_ids)
+    if skipped:
+        flash(f'{skipped} orders skipped - their status has been changed by someone else')
+    return redirect(url_for('dashboard_orders_queue', status=status))
+
+
 @app.route('/dashboard/orders/edit_orders')
 @permitted_only
 def dashboard_edit_orders():
@@ -466,6 +553,12 @@ def dashboard_edit_orders():
 @app.route('/dashboard/orders/edit_order/<int:order_id>', methods=['POST'])
 @permitted_only
 def dashboard_edit_order(order_id):
+    new_status = request.form.get(f'status{order_id}', type=int)
+    # status ktory widzial pracownik przy ladowaniu strony edycji
+    seen_status = request.form.get(f'seen_status{order_id}', type=int)
+    if new_status is None or seen_status is None:
+        flash(f'Missing or invalid status for order id: {order_id}')
+        return redirect(url_for('dashboard_edit_orders'))
     requested_order = database.session.execute(
         database.select(Order).where(Order.id == order_id)).scalar()
 
@@ -478,7 +571,15 @@ def dashboard_edit_order(order_id):
     requested_order.address_home = request.form[f'address_home{order_id}']
     requested_order.address_zip_code = request.form[f'address_zip_code{order_id}']
     requested_order.price = request.form[f'price{order_id}']
-    requested_order.status = request.form[f'status{order_id}']
+    if new_status != seen_status:
+        # status zmieniamy tylko jesli nikt go w miedzyczasie nie przesunal, reszta danych zapisuje sie zawsze
+        result = database.session.execute(
+            database.update(Order).where(Order.id == order_id, Order.status == seen_status)
+            .values(status=new_status).execution_options(synchronize_session=False))
+        if result.rowcount:
+            record_status_changes([(order_id, seen_status, new_status)])
+        else:
+            flash(f'Order id: {order_id} status has been changed by someone else, status not saved, try again')
     database.session.commit()
     return redirect(url_for('dashboard_edit_orders'))
 